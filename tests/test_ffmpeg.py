@@ -0,0 +1,87 @@
+import asyncio
+import shutil
+import subprocess
+from typing import AsyncIterator
+from unittest import IsolatedAsyncioTestCase, skipUnless
+
+from tgtools.utils import file
+from tgtools.utils.file import ffmpeg, set_ffmpeg_parallelism
+
+
+@skipUnless(shutil.which("ffmpeg"), "ffmpeg is not installed")
+class FFmpegCancelTest(IsolatedAsyncioTestCase):
+    def setUp(self) -> None:
+        self.parallelism = file.ffmpeg_parallelism()
+        set_ffmpeg_parallelism(1)
+        self.chunks_read = 0
+        self.stream_closed = asyncio.Event()
+
+    def tearDown(self) -> None:
+        set_ffmpeg_parallelism(self.parallelism)
+
+    async def slow_stream(self) -> AsyncIterator[bytes]:
+        try:
+            while True:
+                self.chunks_read += 1
+                yield b"\0" * 1024
+                await asyncio.sleep(0.05)
+        finally:
+            self.stream_closed.set()
+
+    async def test_cancel_running_command(self) -> None:
+        task = asyncio.create_task(ffmpeg(self.slow_stream(), "-f", "null"))
+        while not self.chunks_read:
+            await asyncio.sleep(0.01)
+
+        task.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await task
+        self.assertTrue(self.stream_closed.is_set())
+
+        chunks_read = self.chunks_read
+        await asyncio.sleep(0.2)
+        self.assertEqual(self.chunks_read, chunks_read)
+
+        # The only slot has been freed for the next command
+        image = subprocess.run(
+            [
+                "ffmpeg",
+                "-f",
+                "lavfi",
+                "-i",
+                "color=size=16x16",
+                "-frames:v",
+                "1",
+                "-f",
+                "image2pipe",
+                "-c:v",
+                "png",
+                "-",
+            ],
+            capture_output=True,
+            check=True,
+        ).stdout
+        output = await asyncio.wait_for(ffmpeg(image, "-f", "image2pipe", "-c:v", "mjpeg"), 10)
+        self.assertIsNotNone(output)
+
+    async def test_cancel_kills_process(self) -> None:
+        processes: list[asyncio.subprocess.Process] = []
+        create = asyncio.create_subprocess_exec
+
+        async def spy(*args: str, **kwargs: int) -> asyncio.subprocess.Process:
+            processes.append(process := await create(*args, **kwargs))  # type: ignore[arg-type]
+            return process
+
+        file.subprocess.create_subprocess_exec = spy  # type: ignore[assignment]
+        try:
+            task = asyncio.create_task(ffmpeg(self.slow_stream(), "-f", "null"))
+            while not self.chunks_read:
+                await asyncio.sleep(0.01)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+        finally:
+            file.subprocess.create_subprocess_exec = create
+
+        self.assertEqual(len(processes), 1)
+        self.assertIsNotNone(processes[0].returncode)
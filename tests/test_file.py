@@ -0,0 +1,56 @@
+import os
+from io import BytesIO
+from pathlib import Path
+from tempfile import NamedTemporaryFile, TemporaryDirectory
+from unittest import TestCase
+from unittest.mock import patch
+
+from tgtools.utils.file import _parallelism_from_env, local_path
+
+
+class LocalPathTest(TestCase):
+    def test_path(self) -> None:
+        with NamedTemporaryFile() as file:
+            self.assertEqual(local_path(file.name), Path(file.name))
+            self.assertEqual(local_path(Path(file.name)), Path(file.name))
+
+    def test_missing_path(self) -> None:
+        with TemporaryDirectory() as directory:
+            self.assertIsNone(local_path(os.path.join(directory, "missing")))
+            self.assertIsNone(local_path(directory))
+
+    def test_open_file(self) -> None:
+        with NamedTemporaryFile() as file:
+            self.assertEqual(local_path(file), Path(file.name))
+            with open(file.name, "rb") as opened:
+                self.assertEqual(local_path(opened), Path(file.name))
+
+    def test_raw_content(self) -> None:
+        self.assertIsNone(local_path(b"content"))
+        self.assertIsNone(local_path(memoryview(b"content")))
+
+    def test_named_buffer(self) -> None:
+        # In-memory uploads often carry a filename, which must not be mistaken for a file on disk
+        with NamedTemporaryFile() as file:
+            buffer = BytesIO(b"content")
+            buffer.name = file.name
+            self.assertIsNone(local_path(buffer))
+
+    def test_closed_file(self) -> None:
+        with NamedTemporaryFile() as file:
+            opened = open(file.name, "rb")
+            opened.close()
+            self.assertIsNone(local_path(opened))
+
+
+class ParallelismFromEnvTest(TestCase):
+    def test_valid(self) -> None:
+        with patch.dict(os.environ, {"TGTOOLS_FFMPEG_PAR": "3"}):
+            self.assertEqual(_parallelism_from_env(), 3)
+
+    def test_invalid(self) -> None:
+        default = max(1, (os.cpu_count() or 2) // 2)
+        for value in ("0", "-1", "many"):
+            with self.subTest(value=value), patch.dict(os.environ, {"TGTOOLS_FFMPEG_PAR": value}):
+                with self.assertLogs("tgtools.utils.file", "WARNING"):
+                    self.assertEqual(_parallelism_from_env(), default)
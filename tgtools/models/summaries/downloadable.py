@@ -1,15 +1,84 @@
+from collections import OrderedDict
+from dataclasses import replace
+from io import BytesIO
 from typing import Awaitable, Callable, Optional, Union
 
 from aiopath import AsyncPath
-from telegram import Document
 from yarl import URL
 
-from tgtools.utils.types import FileOrPath, FilePath
+from tgtools.utils.types import FileOrPath, FilePath, FileStream
 
 from .file_summary import FileExtMixin, FileSummary, MediaFileSummary, MediaMixin
 
 __all__ = ["Downloadable", "DownloadableMedia"]
 
+SUMMARY_CACHE_MAX_BYTES = 100_000_000
+"""Total size in bytes of downloaded media `DownloadableMedia` keeps around for re-use"""
+
+
+class _SummaryCache:
+    """
+    Least recently used cache of downloaded media, keyed by URL and bounded by the total size of the files
+
+    Only files held in memory are cached. Their content is stored as immutable `bytes` and every hit gets its own
+    `BytesIO`, so reading or replacing the file of one summary doesn't affect any other. Paths and open file handles
+    are not cached as the cache cannot own their lifetime.
+
+    Args:
+        max_bytes (int): The maximum total size in bytes of all cached files
+    """
+
+    def __init__(self, max_bytes: int) -> None:
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._summaries: OrderedDict[URL, MediaFileSummary] = OrderedDict()
+
+    def get(self, url: URL) -> Optional[MediaFileSummary]:
+        """
+        Get a cached summary and mark it as recently used
+
+        Args:
+            url (URL): The URL the file was downloaded from
+
+        Returns:
+            A copy of the cached summary with its own `BytesIO` at position 0 or None if there is none
+        """
+        if (summary := self._summaries.get(url)) is None:
+            return None
+        self._summaries.move_to_end(url)
+        return replace(summary, file=BytesIO(summary.file))  # type: ignore[arg-type]
+
+    def put(self, url: URL, summary: MediaFileSummary) -> None:
+        """
+        Cache a summary, evicting the least recently used ones until the total size fits the budget again
+
+        Args:
+            url (URL): The URL the file was downloaded from
+            summary (MediaFileSummary): The summary of the downloaded file
+        """
+        if isinstance(summary.file, BytesIO):
+            content = summary.file.getvalue()  # Shares the buffer until the `BytesIO` is written to
+        elif isinstance(summary.file, (bytes, bytearray, memoryview)):
+            content = bytes(summary.file)
+        else:
+            return
+
+        if len(content) > self.max_bytes:
+            return
+
+        if (previous := self._summaries.pop(url, None)) is not None:
+            self.total_bytes -= len(previous.file)  # type: ignore[arg-type]
+
+        self._summaries[url] = replace(summary, file=content)
+        self.total_bytes += len(content)
+
+        while self.total_bytes > self.max_bytes:
+            _, evicted = self._summaries.popitem(last=False)
+            self.total_bytes -= len(evicted.file)  # type: ignore[arg-type]
+
+
+_summary_cache = _SummaryCache(SUMMARY_CACHE_MAX_BYTES)
+
 
 class Downloadable(FileExtMixin):
     """
@@ -23,12 +92,16 @@ class Downloadable(FileExtMixin):
         size (int): The physical size on the disk in bytes.
         url (URL): The URL of the file
         download_method (Callable[..., Awaitable[FileOrPath]]): The download method taking the url as a parameter
+        stream_method (Callable[..., FileStream], optional): The method streaming the file in chunks taking the url
+            as a parameter
 
     Args:
         url (Union[str, URL]): The url of the file
         size (int): The physical size on the disk in bytes.
         download_method (Callable[..., Awaitable[FileOrPath]]): The download method taking the url as a parameter
         filename (FilePath, optional): The filename either as str, Path or AsyncPath
+        stream_method (Callable[..., FileStream], optional): The method streaming the file in chunks taking the url
+            as a parameter. Allows processing the file while it is still being downloaded.
 
     """
 
@@ -38,27 +111,42 @@ class Downloadable(FileExtMixin):
         size: int,
         download_method: Callable[..., Awaitable[FileOrPath]],
         filename: Optional[FilePath] = None,
+        stream_method: Optional[Callable[..., FileStream]] = None,
     ) -> None:
         self.url = URL(url)
         self.filename = AsyncPath(filename or "").name or self.url.name
         self.download_method = download_method
+        self.stream_method = stream_method
         self.size = size
 
     async def download_to_summary(self) -> FileSummary:
         """
         Download the file and create a `FileSummary`
         """
-        file: FileOrPath = await self.download_method(self.url)
+        from telegram import Document
 
-        summary = FileSummary(
-            filename=self.filename,
-            file=file,
-            size=self.size,
-        )
+        file: FileOrPath = await self.download_method(self.url)
 
         if self.telegram_type is Document:
-            return summary
-        return await MediaFileSummary.from_file_summary(summary=summary)
+            return FileSummary(filename=self.filename, file=file, size=self.size)
+
+        # Build the media summary directly instead of converting an intermediate `FileSummary`
+        width, height = await MediaFileSummary.size_from_file(file=file, ext=self.file_ext)
+        return MediaFileSummary(filename=self.filename, file=file, size=self.size, width=width, height=height)
+
+    def download_stream(self) -> FileStream:
+        """
+        Stream the content of the file chunk by chunk
+
+        Returns:
+            An async iterable yielding the file's content as it is downloaded
+
+        Raises:
+            ValueError: If no `stream_method` was given
+        """
+        if self.stream_method is None:
+            raise ValueError("Streaming the file requires a `stream_method`")
+        return self.stream_method(self.url)
 
     async def as_common(self) -> str:
         """
@@ -79,12 +167,16 @@ class DownloadableMedia(Downloadable, MediaMixin):
         size (int): The physical size on the disk in bytes.
         url (URL): The URL of the file
         download_method (Callable[..., Awaitable[FileOrPath]]): The download method taking the url as a parameter
+        stream_method (Callable[..., FileStream], optional): The method streaming the file in chunks taking the url
+            as a parameter
 
     Args:
         url (Union[str, URL]): The url of the file
         size (int): The physical size on the disk in bytes.
         download_method (Callable[..., Awaitable[FileOrPath]]): The download method taking the url as a parameter
         filename (FilePath, optional): The filename either as str, Path or AsyncPath
+        stream_method (Callable[..., FileStream], optional): The method streaming the file in chunks taking the url
+            as a parameter. Allows processing the file while it is still being downloaded.
 
     """
 
@@ -96,10 +188,12 @@ class DownloadableMedia(Downloadable, MediaMixin):
         height: int,
         download_method: Callable[..., Awaitable[FileOrPath]],
         filename: Optional[FilePath] = None,
+        stream_method: Optional[Callable[..., FileStream]] = None,
     ) -> None:
-        self.filename = AsyncPath(filename or "").name or self.url.name
         self.url = URL(url)
+        self.filename = AsyncPath(filename or "").name or self.url.name
         self.download_method = download_method
+        self.stream_method = stream_method
         self.width = width
         self.height = height
         self.size = size
@@ -107,13 +201,20 @@ class DownloadableMedia(Downloadable, MediaMixin):
     async def download_to_summary(self) -> FileSummary:
         """
         Download the file and create a `MediaFileSummary`
+
+        Recently downloaded files are kept in memory, so sending the same media multiple times only downloads it once.
         """
+        if cached := _summary_cache.get(self.url):
+            return cached
+
         file: FileOrPath = await self.download_method(self.url)
 
-        return MediaFileSummary(
+        summary = MediaFileSummary(
             filename=self.filename,
             file=file,
             size=self.size,
             width=self.width,
             height=self.height,
         )
+        _summary_cache.put(self.url, summary)
+        return summary
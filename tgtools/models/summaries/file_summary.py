@@ -1,17 +1,47 @@
+import os
 from dataclasses import dataclass
 from io import BytesIO
 from pathlib import Path
-from typing import Optional
+from typing import TYPE_CHECKING, Optional, Type, Union
 
 from aiopath import AsyncPath
-from PIL import Image
-from telegram import Animation, Document, PhotoSize, Video
 
-from tgtools.utils.file import ffprobe, read_file_like, seek
-from tgtools.utils.types import GIF_TYPES, IMAGE_TYPES, TELEGRAM_FILES, VIDEO_TYPES, FileOrPath, FilePath
+from tgtools.utils.file import ffprobe, local_path, read_file_like, seek, stream_size
+from tgtools.utils.image import peek_image_size
+from tgtools.utils.types import (
+    FILE_PATH_TYPES,
+    GIF_TYPES,
+    IMAGE_TYPES,
+    TELEGRAM_FILES,
+    VIDEO_TYPES,
+    FileBuffer,
+    FileOrPath,
+)
+
+if TYPE_CHECKING:
+    from telegram import Animation, Document, PhotoSize, Video
 
 __all__ = ["FileSummary", "MediaFileSummary", "MediaMixin", "FileExtMixin"]
 
+_TELEGRAM_TYPES: Optional[tuple[Type["Video"], Type["Animation"], Type["PhotoSize"], Type["Document"]]] = None
+
+
+def _telegram_types() -> tuple[Type["Video"], Type["Animation"], Type["PhotoSize"], Type["Document"]]:
+    """
+    Import the Telegram file classes on first access only
+
+    Importing `telegram` is expensive, so it is deferred until a telegram type is actually needed.
+
+    Returns:
+        The `Video`, `Animation`, `PhotoSize` and `Document` classes in that order
+    """
+    global _TELEGRAM_TYPES
+    if _TELEGRAM_TYPES is None:
+        from telegram import Animation, Document, PhotoSize, Video
+
+        _TELEGRAM_TYPES = Video, Animation, PhotoSize, Document
+    return _TELEGRAM_TYPES
+
 
 class FileExtMixin:
     filename: str
@@ -19,18 +49,20 @@ class FileExtMixin:
     @property
     def file_ext(self) -> str:
         """The file extension, without the leading period."""
-        return Path(self.filename).suffix[1:]
+        # Looked up for every check on the file type, `os.path.splitext` is a lot cheaper than creating a `Path`
+        return os.path.splitext(self.filename)[1][1:]
 
     @property
     def telegram_type(self) -> TELEGRAM_FILES:
+        video, animation, photo_size, document = _telegram_types()
         ext = self.file_ext
         if ext in VIDEO_TYPES:
-            return Video
+            return video
         elif ext in GIF_TYPES:
-            return Animation
+            return animation
         elif ext in IMAGE_TYPES:
-            return PhotoSize
-        return Document
+            return photo_size
+        return document
 
 
 @dataclass
@@ -40,12 +72,12 @@ class FileSummary(FileExtMixin):
 
     Attributes:
         filename (str): The filename of the file
-        file (FileOrPath): A FileLike or FilePath of the media file
+        file (FileOrPath): A FileLike, FilePath or the raw content of the media file
         size (int): The physical size on the disk in bytes.
 
     Args:
         filename (str): The filename of the file
-        file (FileOrPath): A FileLike or FilePath of the media file
+        file (FileOrPath): A FileLike, FilePath or the raw content of the media file
         size (int): The physical size on the disk in bytes.
     """
 
@@ -64,11 +96,15 @@ class FileSummary(FileExtMixin):
         Returns:
             The file's size in bytes as int
         """
-        if isinstance(file, FilePath):  # type: ignore[misc, arg-type]
+        if isinstance(file, BytesIO):
+            return stream_size(file)
+        elif isinstance(file, FILE_PATH_TYPES):
             a_file = AsyncPath(file)
             return (await a_file.stat()).st_size  # type: ignore[no-any-return]
-        elif isinstance(file, BytesIO):
-            return file.getbuffer().nbytes
+        elif isinstance(file, memoryview):
+            return file.nbytes
+        elif isinstance(file, (bytes, bytearray)):
+            return len(file)
         else:
             size = len(await read_file_like(file))
             await seek(file, 0)
@@ -96,11 +132,15 @@ class FileSummary(FileExtMixin):
         """
         Return the content of the file in a commonly used format
         """
-        if isinstance(self.file, (AsyncPath, Path, str)):
-            return Path(str(self.file))
+        if isinstance(self.file, AsyncPath):
+            return Path(os.fspath(self.file))
+        elif isinstance(self.file, Path):
+            return self.file
+        elif isinstance(self.file, str):
+            return Path(self.file)
         elif isinstance(self.file, BytesIO):
             return self.file
-        return await read_file_like(self.file)
+        return bytes(await read_file_like(self.file))
 
 
 class MediaMixin:
@@ -125,14 +165,14 @@ class MediaFileSummary(MediaMixin, FileSummary):
 
     Attributes:
         filename (str): The filename of the file
-        file (FileOrPath): A FileLike or FilePath of the media file
+        file (FileOrPath): A FileLike, FilePath or the raw content of the media file
         size (int): The physical size on the disk in bytes.
         width (int): The width of the media
         height (int): The height of the media
 
     Args:
         filename (str): The filename of the file
-        file (FileOrPath): A FileLike or FilePath of the media file
+        file (FileOrPath): A FileLike, FilePath or the raw content of the media file
         size (int): The physical size on the disk in bytes.
         width (int): The width of the media
         height (int): The height of the media
@@ -190,42 +230,48 @@ class MediaFileSummary(MediaMixin, FileSummary):
         Returns:
             The tuple resolution of the file as width and height in that order
         """
-        file_content = await read_file_like(file=file)
-
         if ext in [*VIDEO_TYPES, *GIF_TYPES]:
-            return await cls._determine_size_video(input=file_content)
+            # Let ffprobe read files already on disk itself instead of loading them into memory first
+            return await cls._determine_size_video(input=local_path(file) or await read_file_like(file=file))
         elif ext in IMAGE_TYPES:
-            return await cls._determine_size_image(input=file_content)
+            return await cls._determine_size_image(input=await read_file_like(file=file))
         else:
             raise NotImplementedError(f"No way to determine size for type `{ext}`")
 
     @staticmethod
-    async def _determine_size_video(input: bytes) -> tuple[int, int]:
+    async def _determine_size_video(input: Union[FileBuffer, Path]) -> tuple[int, int]:
         """
         Get size of any video via ffprobe
 
         Args:
-            input (bytes): The video file as bytes
+            input (Union[FileBuffer, Path]): The video file as bytes or as a path
 
         Returns:
             A tuple of width and height in that order
         """
-        return tuple(  # type: ignore[return-value]
-            (await ffprobe(input, "-select_streams", "v:0", "-show_entries", "stream=width,height"))["streams"][
-                0
-            ].values()
-        )
+        stream = (
+            await ffprobe(input, "-v", "error", "-select_streams", "v:0", "-show_entries", "stream=width,height")
+        )["streams"][0]
+        return stream["width"], stream["height"]
 
     @staticmethod
-    async def _determine_size_image(input: bytes) -> tuple[int, int]:
+    async def _determine_size_image(input: FileBuffer) -> tuple[int, int]:
         """
-        Get size of any image with PIL
+        Get size of any image
+
+        The size of JPEG, PNG, GIF and WebP images is read from their header directly, other formats are opened with
+        PIL.
 
         Args:
-            input (bytes): The image file as bytes
+            input (FileBuffer): The image file as bytes
 
         Returns:
             A tuple of width and height in that order
         """
+        if size := peek_image_size(input):
+            return size
+
+        from PIL import Image
+
         with Image.open(BytesIO(input)) as image:
             return image.size
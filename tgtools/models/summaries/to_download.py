@@ -1,10 +1,9 @@
 from typing import Awaitable, Callable, Optional, Union
 
 from aiopath import AsyncPath
-from telegram import Document
 from yarl import URL
 
-from tgtools.utils.types import FileOrPath, FilePath
+from tgtools.utils.types import FileOrPath, FilePath, FileStream
 
 from .downloadable import Downloadable
 from .file_summary import FileSummary, MediaFileSummary
@@ -20,11 +19,20 @@ class ToDownload(Downloadable):
         url (URL): The URL of the file
         download_method (Callable[..., Awaitable[FileOrPath]]): The download method taking the url as a parameter
         filename (str): The filename of the file, either taken from the `filename` argument or the name in the URL
+        stream_method (Callable[..., FileStream], optional): The method streaming the file in chunks taking the url
+            as a parameter
+        size_method (Callable[..., Awaitable[Optional[int]]], optional): The method looking up the size of the file
+            taking the url as a parameter
 
     Args:
         url (Union[str, URL]): The url of the file
         download_method (Callable[..., Awaitable[FileOrPath]]): The download method taking the url as a parameter
         filename (FilePath, optional): The filename either as str, Path or AsyncPath
+        stream_method (Callable[..., FileStream], optional): The method streaming the file in chunks taking the url
+            as a parameter. Allows processing the file while it is still being downloaded.
+        size_method (Callable[..., Awaitable[Optional[int]]], optional): The method looking up the size of the file
+            taking the url as a parameter, e.g. with a HEAD request. Allows rejecting files that are too big without
+            downloading them. Returns None if the size is unknown.
     """
 
     def __init__(
@@ -32,15 +40,37 @@ class ToDownload(Downloadable):
         url: Union[str, URL],
         download_method: Callable[..., Awaitable[FileOrPath]],
         filename: Optional[FilePath] = None,
+        stream_method: Optional[Callable[..., FileStream]] = None,
+        size_method: Optional[Callable[..., Awaitable[Optional[int]]]] = None,
     ) -> None:
         self.url = URL(url)
         self.download_method = download_method
+        self.stream_method = stream_method
+        self.size_method = size_method
         self.filename = AsyncPath(filename or "").name or self.url.name
+        self._fetched_size: Optional[int] = None
+        self._size_fetched = False
+
+    async def fetch_size(self) -> Optional[int]:
+        """
+        Look up the size of the file without downloading it
+
+        The size is only looked up once, the result is reused afterwards.
+
+        Returns:
+            The size in bytes or None if it is unknown or no `size_method` was given
+        """
+        if not self._size_fetched and self.size_method is not None:
+            self._fetched_size = await self.size_method(self.url)
+            self._size_fetched = True
+        return self._fetched_size
 
     async def download_to_summary(self) -> FileSummary:
         """
         Download the file and create a `FileSummary`
         """
+        from telegram import Document
+
         file: FileOrPath = await self.download_method(self.url)
 
         if self.telegram_type is Document:
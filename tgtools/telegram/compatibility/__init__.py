@@ -11,6 +11,13 @@ from tgtools.utils.types import TELEGRAM_FILES
 
 __all__ = ["make_tg_compatible"]
 
+_COMPATIBILITIES: dict[TELEGRAM_FILES, type[MediaCompatibility]] = {
+    PhotoSize: ImageCompatibility,
+    Video: VideoCompatibility,
+    Animation: GifCompatibility,
+}
+"""The compatibility class used for each Telegram file type, `DocumentCompatibility` for all others"""
+
 
 async def make_tg_compatible(
     file: InputFileType, force_download: bool = False
@@ -26,14 +33,5 @@ async def make_tg_compatible(
         tuple[FileSummary | MediaSummary | None, MediaType]: A tuple containing either the adjusted file summary and
                                                              its type. None if the file is not compatible in any way.
     """
-    compatibility: MediaCompatibility
-    match file.telegram_type:
-        case type_ if type_ is PhotoSize:
-            compatibility = ImageCompatibility(file)
-        case type_ if type_ is Video:
-            compatibility = VideoCompatibility(file)
-        case type_ if type_ is Animation:
-            compatibility = GifCompatibility(file)
-        case _:
-            compatibility = DocumentCompatibility(file)
+    compatibility = _COMPATIBILITIES.get(file.telegram_type, DocumentCompatibility)(file)
     return await compatibility.make_compatible(force_download=force_download)
@@ -29,6 +29,21 @@ class MediaCompatibility(metaclass=ABCMeta):
         """
         self.file = file
 
+    def needs_download(self, force_download: bool = False) -> bool:
+        """
+        Check wether the file has to be downloaded
+
+        Args:
+            force_download (bool, optional): Force download the file (defaults to False)
+
+        Returns:
+            True if the file is not downloaded yet but has to be, False otherwise
+        """
+        size = getattr(self.file, "size", 0) or 0
+        # Files too big to be sent by URL have to be uploaded, as long as they are not too big for that either
+        force_download = force_download or self.MAX_SIZE_URL < size <= self.MAX_SIZE_UPLOAD
+        return (isinstance(self.file, Downloadable) and force_download) or isinstance(self.file, ToDownload)
+
     async def download_if_needed(self, force_download: bool = False) -> OutputFileType:
         """
         Check wether the file has to be downloaded and download it
@@ -39,10 +54,7 @@ class MediaCompatibility(metaclass=ABCMeta):
         Returns:
             A FileSummary or a Downloadable depending on wether the file had to be downloaded or not
         """
-        force_download = force_download or (
-            hasattr(self.file, "size") and self.file.size > self.MAX_SIZE_URL < self.MAX_SIZE_UPLOAD
-        )
-        if (isinstance(self.file, Downloadable) and force_download) or isinstance(self.file, ToDownload):
+        if self.needs_download(force_download=force_download) and isinstance(self.file, Downloadable):
             return await self.file.download_to_summary()
         return self.file
 
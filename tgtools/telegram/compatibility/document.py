@@ -26,7 +26,11 @@ class DocumentCompatibility(MediaCompatibility):
             tuple[MediaSummary | None, MediaType]: A tuple containing the compatible media file (or None if not
                                                    compatible) and its type.
         """
-        if not isinstance(self.file, ToDownload) and self.file.size > self.MAX_SIZE_UPLOAD:
+        if isinstance(self.file, ToDownload):
+            # Avoid downloading a file only to find out it's too big
+            if (size := await self.file.fetch_size()) is not None and size > self.MAX_SIZE_UPLOAD:
+                return None, Document
+        elif self.file.size > self.MAX_SIZE_UPLOAD:
             return None, Document
 
         self.file = await self.download_if_needed(force_download=force_download)
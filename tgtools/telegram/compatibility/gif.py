@@ -1,14 +1,15 @@
 from io import BytesIO
 from pathlib import Path
-from typing import Optional
+from typing import Optional, Union
 
-from telegram import Animation
+from telegram import Animation, Video
 
-from tgtools.models.summaries import Downloadable, MediaFileSummary
+from tgtools.models.summaries import Downloadable, DownloadableMedia, MediaFileSummary, ToDownload
 from tgtools.telegram.compatibility.base import OutputFileType
 from tgtools.telegram.compatibility.video import VideoCompatibility
-from tgtools.utils.file import ffmpeg, read_file_like
-from tgtools.utils.types import TELEGRAM_FILES
+from tgtools.utils.file import ffmpeg, ffprobe, local_path, read_file_like, read_head, stream_size
+from tgtools.utils.matroska import PEEK_SIZE, TRACK_TYPE_AUDIO, peek_tracks
+from tgtools.utils.types import GIF_TYPES, TELEGRAM_FILES, FFmpegInput, FileBuffer
 
 
 class GifCompatibility(VideoCompatibility):
@@ -17,17 +18,88 @@ class GifCompatibility(VideoCompatibility):
     Inherits from DocumentCompatibility.
     """
 
-    async def remove_audio(self, data: bytes) -> BytesIO | None:
+    async def has_audio(self, data: Union[FileBuffer, Path]) -> bool:
+        """
+        Check whether the file contains any audio track
+
+        The headers of Matroska and WebM files are read directly, other files are probed with ffprobe. Both only read
+        the container headers, which is much cheaper than remuxing the whole file.
+
+        Args:
+            data (Union[FileBuffer, Path]): The file to check as bytes or as a path
+
+        Returns:
+            True if the file has audio or if it could not be probed, False otherwise
+        """
+        if (tracks := peek_tracks(await read_head(data, PEEK_SIZE))) is not None:
+            return any(track.type == TRACK_TYPE_AUDIO for track in tracks)
+
+        probe = await ffprobe(data, "-v", "error", "-select_streams", "a", "-show_entries", "stream=index")
+        if probe is None:
+            return True
+        return bool(probe.get("streams"))
+
+    async def remove_audio(self, data: FFmpegInput) -> BytesIO | None:
         """
         Remove all audio tracks without reencoding
 
         Args:
-            data (bytes): The file to adjust as bytes
+            data (FFmpegInput): The file to adjust as bytes, as a stream of chunks or as a path
 
         Returns:
             The new file as BytesIO
         """
-        return await ffmpeg(data, "-an", "-c:v", "copy")
+        return await ffmpeg(data, "-an", "-c:v", "copy", "-f", "mp4", "-movflags", "+faststart")
+
+    def can_stream(self, force_download: bool = False) -> bool:
+        """
+        Check wether the file can be downloaded and converted to mp4 at the same time
+
+        This is the case for GIFs that would be downloaded anyway and whose download can be streamed.
+
+        Args:
+            force_download (bool, optional): Force download the file (defaults to False)
+
+        Returns:
+            True if the file can be streamed, False otherwise
+        """
+        return (
+            isinstance(self.file, Downloadable)
+            and not isinstance(self.file, ToDownload)
+            and self.file.stream_method is not None
+            and self.file.file_ext in GIF_TYPES
+            and self.file.size <= self.MAX_SIZE_UPLOAD
+            and self.needs_download(force_download=force_download)
+        )
+
+    async def stream_to_mp4(self) -> Optional[MediaFileSummary]:
+        """
+        Download the GIF and convert it to mp4 at the same time
+
+        The download is fed into ffmpeg chunk by chunk instead of waiting for it to finish first.
+
+        Returns:
+            The summary of the mp4 or None if it failed
+        """
+        if not isinstance(self.file, Downloadable):
+            return None
+
+        if not (converted := await self.to_mp4(self.file.download_stream())):
+            return None
+
+        filename = Path(self.file.filename).with_suffix(".mp4").name
+        if isinstance(self.file, DownloadableMedia):
+            return MediaFileSummary(
+                filename=filename,
+                file=converted,
+                size=stream_size(converted),
+                width=self.file.width,
+                height=self.file.height,
+            )
+        width, height = await MediaFileSummary.size_from_file(file=converted, ext="mp4")
+        return MediaFileSummary(
+            filename=filename, file=converted, size=stream_size(converted), width=width, height=height
+        )
 
     async def make_compatible(self, force_download: bool = False) -> tuple[Optional[OutputFileType], TELEGRAM_FILES]:
         """
@@ -40,16 +112,23 @@ class GifCompatibility(VideoCompatibility):
             tuple[Optional[OutputFileType], TELEGRAM_FILES]: A tuple containing the compatible media file (or None
                 if not compatible) and its type.
         """
-        file, _ = await super().make_compatible(force_download)
+        if self.can_stream(force_download=force_download) and (summary := await self.stream_to_mp4()):
+            self.file = summary
+            return self.file, Animation
+
+        file, file_type = await super().make_compatible(force_download)
+        if file_type is not Video:
+            return file, file_type  # Too big to be sent, replaced with its first frame
         if not file or not isinstance(file, (Downloadable, MediaFileSummary)):
             return None, Animation
 
         self.file = file
 
         if isinstance(self.file, MediaFileSummary):
-            if converted := await self.remove_audio(await read_file_like(self.file.file)):
+            data = local_path(self.file.file) or await read_file_like(self.file.file)
+            if await self.has_audio(data) and (converted := await self.remove_audio(data)):
                 self.file.file = converted
                 self.file.filename = Path(self.file.filename).with_suffix(".mp4").name
-                self.file.size = converted.getbuffer().nbytes
+                self.file.size = stream_size(converted)
 
         return self.file, Animation
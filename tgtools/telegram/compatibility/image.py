@@ -1,14 +1,27 @@
+import logging
+import math
+from asyncio import to_thread
+from functools import lru_cache
 from io import BytesIO
 from pathlib import Path
-from typing import Optional
+from typing import Any, Optional
 
-from PIL import Image
+from PIL import Image, features
 from telegram import Document, PhotoSize
 
 from tgtools.models.summaries import DownloadableMedia, MediaFileSummary, MediaMixin
 from tgtools.telegram.compatibility.base import MediaCompatibility, OutputFileType
-from tgtools.utils.file import read_file_like
-from tgtools.utils.types import TELEGRAM_FILES
+from tgtools.utils.file import read_file_like, stream_size
+from tgtools.utils.types import TELEGRAM_FILES, FileBuffer
+
+logger = logging.getLogger(__name__)
+
+
+@lru_cache(maxsize=1)
+def _check_libjpeg_turbo() -> None:
+    """Warn once, on the first JPEG save, if Pillow can't use libjpeg-turbo"""
+    if not features.check_feature("libjpeg_turbo"):  # type: ignore[no-untyped-call]
+        logger.warning("Pillow is not built with libjpeg-turbo, encoding JPEGs will be considerably slower")
 
 
 class ImageCompatibility(MediaCompatibility):
@@ -21,12 +34,24 @@ class ImageCompatibility(MediaCompatibility):
         MAX_SIZE_UPLOAD (int): The maximum size of an image file to be uploaded (10 MB).
         MAX_SIZE_URL (int): The maximum size of an image file to be sent as a URL (5 MB).
         MAX_IMAGE_SIZE_SUM (int): The maximum sum of image width and height (10,000).
+        JPEG_QUALITY (int): The quality JPEG images are saved with (85).
+        JPEG_MIN_QUALITY (int): The lowest quality JPEG images are saved with to make them small enough (65).
+        JPEG_OPTIONS (dict[str, Any]): Further options JPEG images are saved with.
     """
 
     MAX_IMAGE_RATIO = 20  # 1:20
     MAX_SIZE_UPLOAD = 10_000_000
     MAX_SIZE_URL = 5_000_000
     MAX_IMAGE_SIZE_SUM = 10_000
+    JPEG_QUALITY = 85
+    JPEG_MIN_QUALITY = 65
+    JPEG_OPTIONS: dict[str, Any] = {
+        "optimize": True,  # Smaller files for a slightly slower encode
+        "subsampling": 2,  # 4:2:0 chroma subsampling, hardly visible at this quality but noticeably smaller
+        "progressive": False,  # Progressive encoding is slower and doesn't make a difference for Telegram
+    }
+
+    _save_buffer: Optional[BytesIO] = None
 
     def resolution_too_heigh(self) -> bool:
         """
@@ -48,7 +73,9 @@ class ImageCompatibility(MediaCompatibility):
         """
         if not isinstance(self.file, MediaMixin):
             return True
-        return self.file.ratio_hw >= self.MAX_IMAGE_RATIO or self.file.ratio_wh >= self.MAX_IMAGE_RATIO
+        width, height = self.file.width, self.file.height
+        # Same as comparing `ratio_hw` and `ratio_wh` but without dividing twice
+        return max(width, height) >= self.MAX_IMAGE_RATIO * min(width, height)
 
     def file_size_too_big(self) -> bool:
         """
@@ -75,67 +102,190 @@ class ImageCompatibility(MediaCompatibility):
             bool: True if the image needs processing (due to resolution, aspect ratio, file size, or format),
                   False otherwise.
         """
-        return self.resolution_too_heigh() or self.ratio_too_drastic() or self.file_size_too_big() or self.is_webp()
+        # Same as the individual checks combined, but with the type checked and the attributes looked up only once
+        file = self.file
+        if not isinstance(file, MediaMixin):
+            return True
+
+        width, height = file.width, file.height
+        return (
+            width + height > self.MAX_IMAGE_SIZE_SUM
+            or max(width, height) >= self.MAX_IMAGE_RATIO * min(width, height)
+            or getattr(file, "size", self.MAX_SIZE_UPLOAD) >= self.MAX_SIZE_UPLOAD
+            or file.file_ext == "webp"
+        )
 
-    async def decrease_file_size(self, decrease_resolution: bool = True) -> None:
+    async def open_image(self, draft_size: Optional[tuple[int, int]] = None) -> Image.Image:
         """
-        Continuously reduce the image resolution until the file size is small enough to upload.
+        Open and decode the image of `self.file`.
+
+        Args:
+            draft_size (tuple[int, int], optional): The size the image is going to be scaled down to. JPEGs are then
+                decoded directly at the smallest 1/2, 1/4 or 1/8 scale that is still at least this big, which is much
+                faster than decoding the full image first.
+
+        Returns:
+            Image.Image: The fully loaded image.
+        """
+        if not isinstance(self.file, MediaFileSummary):
+            raise ValueError("`self.file` needs to be a downloaded piece of media `MediaFileSummary`")
+
+        return await to_thread(self._decode, await read_file_like(self.file.file), draft_size)
+
+    @staticmethod
+    def _decode(data: FileBuffer, draft_size: Optional[tuple[int, int]] = None) -> Image.Image:
+        """
+        Decode an image, blocking until it is fully loaded
+
+        Args:
+            data (FileBuffer): The encoded image
+            draft_size (tuple[int, int], optional): See `open_image`
+
+        Returns:
+            Image.Image: The fully loaded image.
+        """
+        image = Image.open(BytesIO(data))
+        if draft_size and image.format == "JPEG":
+            image.draft("RGB", draft_size)
+        image.load()
+        return image
+
+    async def decrease_file_size(
+        self, decrease_resolution: bool = True, image: Optional[Image.Image] = None, format: Optional[str] = None
+    ) -> Image.Image:
+        """
+        Reduce the image resolution until the file size is small enough to upload.
+
+        The image is encoded once at its current (or maximum allowed) resolution to learn its size in the output
+        format. From that the required resolution is estimated and the image resized once. Should the estimate have
+        been off, JPEGs are first saved with a lower quality down to `JPEG_MIN_QUALITY` before they are resized again.
+
+        Resizing and encoding run in a worker thread, so the event loop is not blocked in the meantime.
 
         Args:
             decrease_resolution (bool, optional): Decrease resolution to the max allowed as PhotoSize while decreasing
                 the file size. This is not needed when sending the file as a Document.
+            image (Image.Image, optional): The already decoded image of `self.file`, opened if not given.
+            format (str, optional): The format to save the image as, defaults to the format of `self.file`.
+
+        Returns:
+            Image.Image: The image in its final resolution.
         """
         if not isinstance(self.file, MediaFileSummary):
             raise ValueError("`self.file` needs to be a downloaded piece of media `MediaFileSummary`")
 
-        with Image.open(BytesIO(await read_file_like(self.file.file))) as image:
-            while self.file_size_too_big():
-                image = self.reduce_resolution(image=image, decrease_resolution=decrease_resolution)
-                await self.update_file(image=image)
+        if image is None:
+            image = await self.open_image()
 
-    async def update_file(self, image: Image.Image, format: Optional[str] = None) -> None:
+        if decrease_resolution and self.resolution_too_heigh():
+            image = await to_thread(self.scale, image, self.MAX_IMAGE_SIZE_SUM / sum(image.size))
+            await self.update_file(image=image, format=format)
+        elif self.file_size_too_big() and self.file.file is not self._save_buffer:
+            # The size in the output format is already known if the image has just been saved, e.g. converted to JPEG
+            await self.update_file(image=image, format=format)
+
+        quality = self.JPEG_QUALITY
+        resized = False
+        while self.file_size_too_big():
+            if resized and self.file.file_ext in ("jpg", "jpeg") and quality > self.JPEG_MIN_QUALITY:
+                quality = max(quality - 10, self.JPEG_MIN_QUALITY)
+            else:
+                image = await to_thread(self.reduce_resolution, image, decrease_resolution)
+                resized = True
+            await self.update_file(image=image, format=format, quality=quality)
+        return image
+
+    async def update_file(self, image: Image.Image, format: Optional[str] = None, **options: Any) -> None:
         """
         Save the image to self.file and update all information accordingly.
 
+        JPEGs are saved with `JPEG_QUALITY` and `JPEG_OPTIONS`, which favour small files that are still quick to
+        encode. Other formats use Pillow's defaults.
+
         Args:
             image (Image.Image): The image to save.
             format (str, optional): The format to save the image as. Defaults to None.
+            **options (Any): Options for `Image.save` overriding the defaults, e.g. `quality`. Only used for JPEGs.
         """
         if not isinstance(self.file, MediaFileSummary):
             raise ValueError("`self.file` needs to be a downloaded piece of media `MediaFileSummary`")
 
-        self.file.file = BytesIO()
+        # Reuse the buffer of the previous save instead of allocating a new one for every attempt. Buffers that didn't
+        # come from here are never overwritten as they may be shared, e.g. with the download cache.
+        if self._save_buffer is None:
+            self._save_buffer = BytesIO()
+        else:
+            self._save_buffer.seek(0)
+            self._save_buffer.truncate()
+        self.file.file = self._save_buffer
+
         format = format or self.file.file_ext
         if format.lower() == "jpg":
             format = "jpeg"
 
-        image.save(self.file.file, format=format)
-        self.file.width, self.file.height = await self.file._determine_size_image(input=self.file.file.getvalue())
+        if format == "jpeg":
+            _check_libjpeg_turbo()
+            options = {"quality": self.JPEG_QUALITY, **self.JPEG_OPTIONS, **options}
+        else:
+            options = {}
+        await to_thread(image.save, self.file.file, format=format, **options)
+        self.file.size = stream_size(self.file.file)
+        self.file.width, self.file.height = image.size
         if format != self.file.file_ext:
             self.file.filename = Path(self.file.filename).with_suffix(f".{format}").name
 
         self.file.file.seek(0)
 
-    async def convert_to_jpeg(self) -> None:
+    async def convert_to_jpeg(self, image: Optional[Image.Image] = None) -> Image.Image:
         """
         Convert the image to a JPEG format.
 
+        Args:
+            image (Image.Image, optional): The already decoded image of `self.file`, opened if not given.
+
         Returns:
             Image.Image: The converted image in JPEG format.
         """
         if not isinstance(self.file, MediaFileSummary):
             raise ValueError("`self.file` needs to be a downloaded piece of media `MediaFileSummary`")
 
-        with Image.open(BytesIO(await read_file_like(self.file.file))) as image:
-            if image.mode == "RGBA":
-                white_background = Image.new("RGB", image.size, (255, 255, 255))
-                white_background.paste(image, (0, 0), image)
-                image = white_background
-            await self.update_file(image, "jpeg")
+        if image is None:
+            image = await self.open_image()
+
+        image = await to_thread(self._flatten, image)
+        await self.update_file(image, "jpeg")
+        return image
+
+    @staticmethod
+    def _flatten(image: Image.Image) -> Image.Image:
+        """
+        Convert an image to a mode that can be saved as JPEG, placing transparent images on a white background
+
+        Args:
+            image (Image.Image): The image to convert
+
+        Returns:
+            Image.Image: The image in RGB or L mode.
+        """
+        if image.mode in ("LA", "PA") or (image.mode == "P" and "transparency" in image.info):
+            image = image.convert("RGBA")
+
+        if image.mode == "RGBA":
+            white_background = Image.new("RGB", image.size, (255, 255, 255))
+            # Blending through the alpha mask is a single pass in C. A NumPy version needs several passes with 16-bit
+            # temporaries and NumPy is not a direct dependency, so Pillow does this on its own.
+            white_background.paste(image, (0, 0), image)  # Use the alpha channel as mask
+            return white_background
+        elif image.mode not in ("RGB", "L"):
+            return image.convert("RGB")  # No alpha to flatten, e.g. palette or CMYK images
+        return image
 
     def reduce_resolution(self, image: Image.Image, decrease_resolution: bool = True) -> Image.Image:
         """
-        Reduce the resolution of the image to either the maximum allowed size or to 90% of its current size.
+        Reduce the resolution of the image so that it fits the maximum allowed file size and resolution.
+
+        The size of an encoded image grows roughly linearly with its pixel count, so both sides are scaled by the
+        square root of how much too big the file is. A 5% margin is added in case the estimate is off.
 
         Args:
             image (Image.Image): The image to reduce the resolution of.
@@ -145,13 +295,29 @@ class ImageCompatibility(MediaCompatibility):
         Returns:
             Image.Image: The image with reduced resolution.
         """
-        """Reduce resolution to either max allowed size or to 0.9 of it's current size"""
-        resize_ratio = 0.9
-        if decrease_resolution and self.resolution_too_heigh():
-            resize_ratio = self.MAX_IMAGE_SIZE_SUM / (sum(image.size))
+        resize_ratio = 1.0
+        if (size := self.file.size) >= self.MAX_SIZE_UPLOAD:
+            resize_ratio = math.sqrt(self.MAX_SIZE_UPLOAD / size) * 0.95
+        if decrease_resolution and (total := image.width + image.height) > self.MAX_IMAGE_SIZE_SUM:
+            resize_ratio = min(resize_ratio, self.MAX_IMAGE_SIZE_SUM / total)
 
-        image = image.resize((int(image.width * resize_ratio), int(image.height * resize_ratio)))
-        return image
+        return self.scale(image=image, ratio=resize_ratio)
+
+    def scale(self, image: Image.Image, ratio: float) -> Image.Image:
+        """
+        Resize the image by the given ratio while keeping its aspect ratio.
+
+        Args:
+            image (Image.Image): The image to resize.
+            ratio (float): The factor to multiply width and height with.
+
+        Returns:
+            Image.Image: The resized image.
+        """
+        # The image is lossily compressed afterwards anyway, so the faster bilinear filter is good enough. For large
+        # reductions the reducing gap first shrinks the image by an integer factor, which is much faster.
+        width, height = image.size
+        return image.resize((int(width * ratio), int(height * ratio)), Image.Resampling.BILINEAR, reducing_gap=2.0)
 
     async def make_compatible(self, force_download: bool = False) -> tuple[Optional[OutputFileType], TELEGRAM_FILES]:
         """
@@ -178,14 +344,30 @@ class ImageCompatibility(MediaCompatibility):
 
         self.file = file
 
-        if self.ratio_too_drastic():
-            await self.decrease_file_size(decrease_resolution=False)
-            return self.file, Document
-
-        if self.is_webp():
-            await self.convert_to_jpeg()
-
-        if self.resolution_too_heigh():
-            await self.decrease_file_size(decrease_resolution=True)
+        if not self.needs_processing():
+            return self.file, PhotoSize
+
+        draft_size = None
+        if isinstance(self.file, MediaMixin) and self.resolution_too_heigh() and not self.ratio_too_drastic():
+            width, height = self.file.width, self.file.height
+            ratio = self.MAX_IMAGE_SIZE_SUM / (width + height)
+            draft_size = int(width * ratio), int(height * ratio)
+
+        # Decode the image only once and hand it through all processing steps
+        with await self.open_image(draft_size=draft_size) as image:
+            if self.ratio_too_drastic():
+                await self.decrease_file_size(decrease_resolution=False, image=image)
+                return self.file, Document
+
+            if self.is_webp():
+                if self.resolution_too_heigh():
+                    # Scale before saving as JPEG instead of saving the image at full resolution first
+                    image = await to_thread(self._flatten, image)
+                    await self.decrease_file_size(decrease_resolution=True, image=image, format="jpeg")
+                    return self.file, PhotoSize
+                image = await self.convert_to_jpeg(image=image)
+
+            if self.resolution_too_heigh() or self.file_size_too_big():
+                await self.decrease_file_size(decrease_resolution=True, image=image)
 
         return self.file, PhotoSize
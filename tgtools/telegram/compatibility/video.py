@@ -1,14 +1,42 @@
+import os
 from io import BytesIO
 from pathlib import Path
-from typing import Optional
+from typing import Optional, Union
 
-from telegram import Video
+from telegram import PhotoSize, Video
 
 from tgtools.models.summaries import Downloadable, MediaFileSummary
 from tgtools.telegram.compatibility.base import OutputFileType
 from tgtools.telegram.compatibility.document import DocumentCompatibility
-from tgtools.utils.file import ffmpeg, read_file_like
-from tgtools.utils.types import TELEGRAM_FILES
+from tgtools.utils.file import ffmpeg, ffmpeg_capabilities, local_path, read_file_like, read_head, stream_size
+from tgtools.utils.image import peek_image_size
+from tgtools.utils.matroska import PEEK_SIZE, TRACK_TYPE_VIDEO, peek_tracks
+from tgtools.utils.types import TELEGRAM_FILES, FFmpegInput, FileBuffer
+
+H264_ENCODERS: dict[str, tuple[str, ...]] = {
+    "h264_nvenc": ("-preset", "p3", "-tune", "hq"),
+    "h264_qsv": ("-preset", "veryfast"),
+    "h264_vaapi": ("-vaapi_device", "/dev/dri/renderD128"),
+    "h264_videotoolbox": (),
+    # Telegram needs a compatible file, not an archival copy, so trade some quality for a much faster encode. Use all
+    # cores, resolved once here instead of leaving ffmpeg to detect them on every encode.
+    "libx264": ("-preset", "veryfast", "-crf", "28", "-threads", str(os.cpu_count() or 0)),
+}
+"""H.264 encoders in order of preference, hardware encoders first, with the options they are used with"""
+
+_unusable_encoders: set[str] = set()
+"""Hardware encoders listed by ffmpeg that failed to encode a video libx264 could encode, e.g. for a missing device"""
+
+
+async def h264_encoder() -> str:
+    """
+    Find the preferred H.264 encoder supported by the installed ffmpeg
+
+    Returns:
+        The name of the encoder, `libx264` if no usable hardware encoder is available
+    """
+    available = (await ffmpeg_capabilities())["encoders"] - _unusable_encoders
+    return next((encoder for encoder in H264_ENCODERS if encoder in available), "libx264")
 
 
 class VideoCompatibility(DocumentCompatibility):
@@ -17,7 +45,7 @@ class VideoCompatibility(DocumentCompatibility):
     Inherits from DocumentCompatibility.
     """
 
-    async def make_streamable(self, data: bytes) -> BytesIO | None:
+    async def make_streamable(self, data: Union[FileBuffer, Path]) -> BytesIO | None:
         """
         Make an mp4 streamable without reencoding.
 
@@ -25,22 +53,56 @@ class VideoCompatibility(DocumentCompatibility):
         No reencoding takes place so this should be rather fast.
 
         Args:
-            data (bytes): The existing mp4 data
+            data (Union[FileBuffer, Path]): The existing mp4 data
+
+        Returns:
+            BytesIO of the new file.
+        """
+        return await ffmpeg(data, "-f", "mp4", "-c", "copy", "-movflags", "+faststart")
+
+    async def can_remux(self, data: Union[FileBuffer, Path]) -> bool:
+        """
+        Check wether a Matroska or WebM video can be put into an mp4 container without reencoding the video
+
+        Only the file's headers are read, which is much cheaper than probing it with ffprobe.
+
+        Args:
+            data (Union[FileBuffer, Path]): The existing video data
+
+        Returns:
+            True if the video track is H.264, False otherwise or if the tracks could not be read
+        """
+        if not (tracks := peek_tracks(await read_head(data, PEEK_SIZE))):
+            return False
+        return all(track.codec == "V_MPEG4/ISO/AVC" for track in tracks if track.type == TRACK_TYPE_VIDEO)
+
+    async def remux_to_mp4(self, data: Union[FileBuffer, Path]) -> BytesIO | None:
+        """
+        Put an H.264 video into a streamable mp4 container without reencoding the video
+
+        Audio tracks are converted to AAC, which is cheap compared to encoding video, as not all audio codecs
+        supported by Matroska are supported by mp4.
+
+        Args:
+            data (Union[FileBuffer, Path]): The existing video data
 
         Returns:
             BytesIO of the new file.
         """
-        return await ffmpeg(data, "-f", "mp4", "-c copy", "-movflags", "+faststart")
+        return await ffmpeg(data, "-c:v", "copy", "-c:a", "aac", "-f", "mp4", "-movflags", "+faststart")
 
-    async def to_mp4(self, data: bytes) -> BytesIO | None:
+    async def to_mp4(self, data: FFmpegInput) -> BytesIO | None:
         """
         Convert a any video (in BytesIO format) to an MP4 video (in BytesIO format) asynchronously.
 
         This function uses FFmpeg to perform the conversion. This also enables streamability just like the
         `make_streamable` method.
 
+        Should a hardware encoder fail, the conversion is retried with libx264. This is not possible for a stream, which
+        can only be read once, None is returned instead.
+
         Args:
-            data (BytesIO): The input video as a BytesIO object.
+            data (FFmpegInput): The input video in memory, as a stream or on disk.
 
         Returns:
             BytesIO | None: The output MP4 video as a BytesIO object, or None if the conversion fails.
@@ -50,14 +112,87 @@ class VideoCompatibility(DocumentCompatibility):
             >>> mp4_data = await webm_to_mp4(webm_data)
             # `mp4_data` will be a BytesIO object containing the converted MP4 video or None if the conversion failed
         """
-        video_filter = "-vf", "scale=trunc(iw/2)*2:trunc(ih/2)*2"  # Make sure we have even width and height
-        codec = "-c:v", "libx264"  # Use H264 codec (faster to encode compared to H265)
+        encoder = await h264_encoder()
+        if encoder == "libx264":
+            return await self._to_mp4(data, encoder)
+        if conversion := await self._to_mp4(data, encoder):
+            return conversion
+        if not isinstance(data, (bytes, bytearray, memoryview, Path)):
+            return None
+
+        # Hardware encoders may be listed by ffmpeg without the matching device being present. Should libx264 succeed
+        # where the hardware encoder failed, the video was fine and the encoder is not used again.
+        if conversion := await self._to_mp4(data, "libx264"):
+            _unusable_encoders.add(encoder)
+        return conversion
+
+    async def _to_mp4(self, data: FFmpegInput, encoder: str) -> BytesIO | None:
+        """
+        Convert any video to an MP4 video with the given H.264 encoder
+
+        Args:
+            data (FFmpegInput): The input video
+            encoder (str): One of the encoders in `H264_ENCODERS`
+
+        Returns:
+            BytesIO | None: The output MP4 video as a BytesIO object, or None if the conversion fails.
+        """
+        scale = "scale=trunc(iw/2)*2:trunc(ih/2)*2"  # Make sure we have even width and height
+        pixel_format: tuple[str, ...] = "-pix_fmt", "yuv420p"  # Ensure supported colors
+        if encoder == "h264_vaapi":
+            scale += ",format=nv12,hwupload"  # VAAPI encodes frames uploaded to the GPU in its own pixel format
+            pixel_format = ()
+
+        video_filter = "-vf", scale
+        codec = "-c:v", encoder, *H264_ENCODERS[encoder]  # Use H264 codec (faster to encode compared to H265)
         # output_format = "-f", "ismv"  # May not be supported (Internet Streaming Media Format)
         output_format = "-f", "mp4"  # Use a mp4 container
-        output_options = "-movflags", "+faststart", "-pix_fmt", "yuv420p"  # Streamability and ensure supported colors
+        output_options = "-movflags", "+faststart", *pixel_format  # Streamability
 
         return await ffmpeg(data, *video_filter, *codec, *output_format, *output_options)
 
+    async def first_frame(self, data: FFmpegInput) -> BytesIO | None:
+        """
+        Extract the first frame of a video as JPEG
+
+        ffmpeg encodes the frame itself and stops reading the input right after it, so for a stream only the start of
+        the video is downloaded.
+
+        Args:
+            data (FFmpegInput): The video in memory, as a stream or on disk
+
+        Returns:
+            BytesIO | None: The frame as JPEG or None if it could not be extracted.
+        """
+        return await ffmpeg(data, "-frames:v", "1", "-c:v", "mjpeg", "-q:v", "2", "-f", "image2pipe")
+
+    async def first_frame_summary(self) -> Optional[MediaFileSummary]:
+        """
+        Extract the first frame of the video to be sent in its place
+
+        Returns:
+            The summary of the frame as JPEG or None if the video is not available locally or as a stream, or the frame
+            could not be extracted
+        """
+        source: FFmpegInput
+        if isinstance(self.file, MediaFileSummary):
+            source = local_path(self.file.file) or await read_file_like(file=self.file.file)
+        elif isinstance(self.file, Downloadable) and self.file.stream_method is not None:
+            source = self.file.download_stream()
+        else:
+            return None
+
+        if not (frame := await self.first_frame(data=source)) or not (size := peek_image_size(frame.getvalue())):
+            return None
+
+        return MediaFileSummary(
+            filename=Path(self.file.filename).with_suffix(".jpg").name,
+            file=frame,
+            size=stream_size(frame),
+            width=size[0],
+            height=size[1],
+        )
+
     async def make_compatible(self, force_download: bool = False) -> tuple[Optional[OutputFileType], TELEGRAM_FILES]:
         """
         Make the video file compatible with Telegram by checking its size and downloading if necessary.
@@ -73,21 +208,28 @@ class VideoCompatibility(DocumentCompatibility):
         """
 
         file, _ = await super().make_compatible(force_download=force_download or self.file.file_ext in ["mkv", "webm"])
-        if not file or not isinstance(file, (Downloadable, MediaFileSummary)):
+        if not file:
+            if frame := await self.first_frame_summary():
+                return frame, PhotoSize
+            return None, Video
+        if not isinstance(file, (Downloadable, MediaFileSummary)):
             return None, Video
 
         self.file = file
 
         if isinstance(self.file, MediaFileSummary):
-            file_content = await read_file_like(file=self.file.file)
-            if self.file.file_ext in ["mp4", "mkv"]:
+            # Let ffmpeg read files already on disk itself instead of loading them into memory first
+            file_content = local_path(self.file.file) or await read_file_like(file=self.file.file)
+            if self.file.file_ext == "mp4":
                 conversion = await self.make_streamable(data=file_content)
+            elif await self.can_remux(data=file_content):
+                conversion = await self.remux_to_mp4(data=file_content)
             else:
                 conversion = await self.to_mp4(data=file_content)
 
             if conversion:
                 self.file.filename = Path(self.file.filename).with_suffix(".mp4").name
-                self.file.size = conversion.getbuffer().nbytes
+                self.file.size = stream_size(conversion)
                 self.file.file = conversion
 
         return self.file, Video
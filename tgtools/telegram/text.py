@@ -1,6 +1,49 @@
-import re
-from random import choices
-from typing import Iterable
+from functools import lru_cache
+from itertools import islice
+from math import exp, floor, log
+from random import random, randrange, sample
+from typing import Iterable, Iterator, Sequence, TypeVar
+
+_T = TypeVar("_T")
+
+
+class _HashtagTable(dict[int, int]):
+    """
+    Translation table replacing every character that is not allowed in a hashtag with an underscore
+
+    ASCII letters, digits, underscores and whitespace other than spaces are kept. As there are far too many characters
+    to list them all upfront, each character is looked up the first time it is seen and remembered afterwards.
+    """
+
+    def __missing__(self, codepoint: int) -> int:
+        character = chr(codepoint)
+        allowed = (character.isascii() and character.isalnum()) or character == "_" or character.isspace()
+        self[codepoint] = replacement = codepoint if allowed else ord("_")
+        return replacement
+
+
+_HASHTAG_TABLE = _HashtagTable({ord(" "): ord("_")})
+_DIGITS = frozenset("0123456789")  # Only ASCII digits remain after translating with `_HASHTAG_TABLE`
+
+
+@lru_cache(maxsize=4096)
+def _hashtags(tag: str) -> tuple[str, ...]:
+    """
+    Convert a single tag into hashtags, see `tagify`
+
+    The same tags come up over and over again, so the results are cached.
+
+    Args:
+        tag (str): The tag to convert
+
+    Returns:
+        tuple[str, ...]: The hashtags, usually one or none, more if the tag contains whitespace such as newlines.
+    """
+    # Replace spaces and non-alphanumeric characters (except for underscores) with underscores
+    parts = tag.translate(_HASHTAG_TABLE).split()
+
+    # Add a hashtag to each tag, and prefix tags starting with a digit with an underscore
+    return tuple("#_" + part if part[0] in _DIGITS else "#" + part for part in parts if part.strip("_"))
 
 
 def tagify(tags: Iterable[str] | str) -> set[str]:
@@ -9,6 +52,8 @@ def tagify(tags: Iterable[str] | str) -> set[str]:
 
     If a tag starts with a digit, it is prefixed with an underscore.
     Non-alphanumeric characters (except for underscores) are replaced with underscores.
+    Tags consisting only of underscores afterwards are dropped.
+    Spaces within a tag are replaced with underscores, any other whitespace splits it into multiple tags.
     The input can be either a single string or an iterable of strings.
 
     Args:
@@ -39,14 +84,35 @@ def tagify(tags: Iterable[str] | str) -> set[str]:
     if isinstance(tags, str):
         tags = [tags]
 
-    # Replace spaces with underscores and join the tags
-    tags = " ".join(map(lambda s: s.replace(" ", "_"), tags))
+    return {hashtag for tag in tags for hashtag in _hashtags(tag)}
 
-    # Replace non-alphanumeric characters (except for underscores) with underscores
-    tags = re.sub(r"\b_+\b", "", re.sub(r"(?![_a-zA-Z0-9\s]).", "_", tags)).split(" ")
 
-    # Add a hashtag to each tag, and prefix tags starting with a digit with an underscore
-    return {f"#_{tag}" if tag[0].isdigit() else f"#{tag}" for tag in filter(None, tags)}
+def _reservoir_sample(items: Iterable[_T], k: int) -> list[_T]:
+    """
+    Pick `k` random items without replacement in a single pass and without holding all items in memory
+
+    Uses reservoir sampling (Algorithm L), which skips ahead over items instead of drawing a random number for each.
+
+    Args:
+        items (Iterable[_T]): The items to pick from, of unknown length
+        k (int): The number of items to pick
+
+    Returns:
+        list[_T]: The picked items, all of them if there are `k` or fewer
+    """
+    iterator: Iterator[_T] = iter(items)
+    reservoir = list(islice(iterator, k))
+    if len(reservoir) < k:
+        return reservoir
+
+    weight = exp(log(1.0 - random()) / k)
+    while True:
+        skip = floor(log(1.0 - random()) / log(1.0 - weight))
+        try:
+            reservoir[randrange(k)] = next(islice(iterator, skip, None))
+        except StopIteration:
+            return reservoir
+        weight *= exp(log(1.0 - random()) / k)
 
 
 def tagified_string(tags: Iterable[str], limit: int = 0) -> str:
@@ -55,7 +121,8 @@ def tagified_string(tags: Iterable[str], limit: int = 0) -> str:
 
     Args:
         tags (Iterable[str]): An iterable of tags (strings).
-        limit (int, optional): The maximum number of tags to include in the output string. Defaults to 0 (no limit).
+        limit (int, optional): The maximum number of tags to include in the output string, picked at random. Defaults
+            to 0 (no limit).
 
     Returns:
         str: A string of hashtag-like strings separated by commas.
@@ -68,5 +135,8 @@ def tagified_string(tags: Iterable[str], limit: int = 0) -> str:
         "#hello" or "#world"
     """
     if limit:
-        tags = choices(list(tags), k=limit)
+        # Without duplicates, unlike `choices`. Tags of unknown length are not copied into a list first.
+        tags = sample(tags, min(limit, len(tags))) if isinstance(tags, Sequence) else _reservoir_sample(tags, limit)
+    if not tags:
+        return ""
     return ", ".join(tagify(tags))
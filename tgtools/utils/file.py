@@ -1,55 +1,406 @@
-import json
-from asyncio import iscoroutinefunction, subprocess
-from io import BytesIO
-from typing import Any
+import logging
+import os
+import stat
+from asyncio import (
+    AbstractEventLoop,
+    Semaphore,
+    StreamReader,
+    StreamWriter,
+    gather,
+    get_running_loop,
+    iscoroutinefunction,
+    subprocess,
+)
+from io import SEEK_END, BytesIO
+from pathlib import Path
+from shutil import which
+from tempfile import mkstemp
+from typing import Any, Awaitable, Optional, TypedDict, Union
+from weakref import WeakKeyDictionary
 
 from aiopath import AsyncPath
 
-from tgtools.utils.types import FileOrPath, FilePath
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads  # type: ignore[assignment]
+
+from tgtools.utils.types import FILE_PATH_TYPES, FFmpegInput, FileBuffer, FileOrPath, FileStream
+
+CHUNK_SIZE = 1 << 20
+"""Size in bytes of the chunks piped into and out of subprocesses"""
+
+SYNC_READ_SIZE = 64 * 1024
+"""Files on disk up to this size in bytes are read directly, for them handing the read to a thread takes longer"""
+
+logger = logging.getLogger(__name__)
+
+
+def _parallelism_from_env() -> int:
+    """
+    Read the number of ffmpeg processes allowed to run at the same time from `TGTOOLS_FFMPEG_PAR`
+
+    Returns:
+        The configured number or half the CPU cores if it is not set or not a positive integer
+    """
+    default = max(1, (os.cpu_count() or 2) // 2)
+    if not (value := os.environ.get("TGTOOLS_FFMPEG_PAR")):
+        return default
+    try:
+        if (parallelism := int(value)) >= 1:
+            return parallelism
+    except ValueError:
+        pass
+    logger.warning("TGTOOLS_FFMPEG_PAR must be a positive integer, got %r, using %d instead", value, default)
+    return default
+
+
+FFMPEG_PARALLELISM = _parallelism_from_env()
+"""Default number of ffmpeg processes running at the same time, configurable with `TGTOOLS_FFMPEG_PAR`"""
+
+_ffmpeg_parallelism = FFMPEG_PARALLELISM
+_ffmpeg_semaphores: "WeakKeyDictionary[AbstractEventLoop, Semaphore]" = WeakKeyDictionary()
+
+FFMPEG_BINARY = which("ffmpeg") or "ffmpeg"
+FFPROBE_BINARY = which("ffprobe") or "ffprobe"
+"""Paths of the ffmpeg and ffprobe executables, looked up in `PATH` once instead of for every process"""
+
+_coroutine_methods: dict[tuple[type, str], bool] = {}
+
+_ffmpeg_capabilities: Optional["FFmpegCapabilities"] = None
+
+SEEKABLE_OUTPUT_FORMATS = frozenset({"mp4", "mov", "ipod"})
+"""ffmpeg output formats whose muxer has to seek in the output file and therefore cannot write to a pipe"""
+
+
+class FFmpegCapabilities(TypedDict):
+    """
+    Features supported by the installed ffmpeg
+
+    Attributes:
+        encoders (frozenset[str]): The names of all available encoders, e.g. `libx264` or `h264_nvenc`
+        hwaccels (frozenset[str]): The names of all available hardware acceleration methods, e.g. `cuda` or `vaapi`
+    """
+
+    encoders: frozenset[str]
+    hwaccels: frozenset[str]
+
+
+async def _ffmpeg_list(option: str) -> list[str]:
+    """
+    Run ffmpeg with one of its listing options and return the output lines
+
+    Args:
+        option (str): The listing option e.g. `-encoders`
+
+    Returns:
+        The lines of the output or an empty list if ffmpeg is not available
+    """
+    try:
+        process = await subprocess.create_subprocess_exec(
+            FFMPEG_BINARY,
+            "-hide_banner",
+            option,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+        )
+    except FileNotFoundError:
+        return []
+    stdout, _ = await process.communicate()
+    return stdout.decode(errors="replace").splitlines()
+
+
+async def ffmpeg_capabilities() -> FFmpegCapabilities:
+    """
+    Find out which features the installed ffmpeg supports
+
+    ffmpeg is only asked the first time, the result is reused for the rest of the process. It is asked without
+    blocking the event loop.
+
+    Returns:
+        The encoders and hardware acceleration methods supported by ffmpeg, both empty if ffmpeg is not available
+    """
+    global _ffmpeg_capabilities
+    if _ffmpeg_capabilities is not None:
+        return _ffmpeg_capabilities
+
+    encoder_lines, hwaccel_lines = await gather(_ffmpeg_list("-encoders"), _ffmpeg_list("-hwaccels"))
+    if "------" in (lines := [line.strip() for line in encoder_lines]):
+        encoder_lines = encoder_lines[lines.index("------") + 1 :]  # Skip the legend explaining the flags
+    encoders = frozenset(columns[1] for line in encoder_lines if len(columns := line.split()) > 1)
+
+    hwaccels = frozenset(line.strip() for line in hwaccel_lines[1:] if line.strip())
+    _ffmpeg_capabilities = {"encoders": encoders, "hwaccels": hwaccels}
+    return _ffmpeg_capabilities
+
+
+def stream_size(file: BytesIO) -> int:
+    """
+    Get the size of a seekable in-memory file without exporting its buffer
+
+    The current stream position is preserved.
+
+    Args:
+        file (BytesIO): The file to measure
+
+    Returns:
+        The size of the file in bytes
+    """
+    position = file.tell()
+    size = file.seek(0, SEEK_END)
+    file.seek(position)
+    return size
+
+
+def _is_coroutine_method(method: Any, file: Any, name: str) -> bool:
+    """
+    Check whether a method of a file is a coroutine function
+
+    The answer is the same for all files of a type, so it is only looked up once per type.
+
+    Args:
+        method (Any): The method as taken from the file
+        file (Any): The file the method belongs to
+        name (str): The name of the method, e.g. `seek`
+
+    Returns:
+        True if the method has to be awaited, False otherwise
+    """
+    key = type(file), name
+    if (is_coroutine := _coroutine_methods.get(key)) is None:
+        is_coroutine = _coroutine_methods[key] = iscoroutinefunction(method)
+    return is_coroutine
 
 
 async def seek(file: Any, offset: int) -> None:
-    if seek := getattr(file, "seek"):
-        if iscoroutinefunction(seek):
+    if seek := getattr(file, "seek", None):
+        if _is_coroutine_method(seek, file, "seek"):
             await seek(offset)
         else:
             seek(offset)
 
 
-async def ffmpeg(input: bytes, *arguments: str) -> BytesIO | None:
+async def _feed(stdin: StreamWriter, data: Union[FileBuffer, FileStream]) -> None:
+    """
+    Write data into a subprocess's stdin chunk by chunk and close it afterwards
+
+    Args:
+        stdin (StreamWriter): The stdin of the subprocess
+        data (Union[FileBuffer, FileStream]): The data to write, either in memory or arriving chunk by chunk
+    """
+    try:
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            view = memoryview(data).cast("B")
+            for offset in range(0, view.nbytes, CHUNK_SIZE):
+                stdin.write(view[offset : offset + CHUNK_SIZE])
+                await stdin.drain()
+        else:
+            async for chunk in data:
+                stdin.write(chunk)
+                await stdin.drain()
+    except (BrokenPipeError, ConnectionResetError):
+        pass  # The process stopped reading, it either has all it needs or failed
+    finally:
+        stdin.close()
+        # Close the stream right away if it was not read to the end, e.g. to abort the download behind it
+        if aclose := getattr(data, "aclose", None):
+            await aclose()
+
+
+async def _drain(stdout: StreamReader, output: BytesIO) -> None:
+    """
+    Read a subprocess's stdout chunk by chunk until it is closed
+
+    Args:
+        stdout (StreamReader): The stdout of the subprocess
+        output (BytesIO): The buffer to collect the output in
+    """
+    while chunk := await stdout.read(CHUNK_SIZE):
+        output.write(chunk)
+
+
+async def _supervise(process: subprocess.Process, *tasks: Awaitable[Any]) -> None:
+    """
+    Wait for a subprocess to exit together with the tasks feeding and draining it
+
+    Should waiting be interrupted, e.g. by cancelling the surrounding task, the process is killed instead of being left
+    running on its own.
+
+    Args:
+        process (subprocess.Process): The subprocess
+        *tasks (Awaitable[Any]): The tasks feeding its stdin and draining its stdout
+    """
+    try:
+        await gather(*tasks, process.wait())
+    except BaseException:
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+        raise
+
+
+def ffmpeg_parallelism() -> int:
+    """
+    Get how many ffmpeg processes may run at the same time
+
+    Returns:
+        The number of ffmpeg processes, `FFMPEG_PARALLELISM` unless changed with `set_ffmpeg_parallelism`
+    """
+    return _ffmpeg_parallelism
+
+
+def set_ffmpeg_parallelism(n: int) -> None:
+    """
+    Set how many ffmpeg processes may run at the same time
+
+    Commands that are already running or waiting keep the previous limit.
+
+    Args:
+        n (int): The number of ffmpeg processes, at least 1
+    """
+    global _ffmpeg_parallelism
+    if n < 1:
+        raise ValueError("At least one ffmpeg process has to be allowed to run")
+    _ffmpeg_parallelism = n
+    _ffmpeg_semaphores.clear()
+
+
+def _ffmpeg_semaphore() -> Semaphore:
+    """
+    Get the semaphore limiting the ffmpeg processes of the current event loop
+
+    A semaphore can only be used within a single event loop, so each loop gets its own.
+
+    Returns:
+        The semaphore of the running event loop
+    """
+    loop = get_running_loop()
+    if (semaphore := _ffmpeg_semaphores.get(loop)) is None:
+        semaphore = _ffmpeg_semaphores[loop] = Semaphore(_ffmpeg_parallelism)
+    return semaphore
+
+
+def local_path(file: FileOrPath) -> Optional[Path]:
+    """
+    Get the path of a file that exists on the local disk
+
+    Args:
+        file (FileOrPath): The file as file like, path like or raw content
+
+    Returns:
+        The path for file paths and file objects opened from disk (e.g. `open()` or `NamedTemporaryFile`), None for
+        everything else such as in-memory buffers
+    """
+    if isinstance(file, (bytes, bytearray, memoryview)):
+        return None
+    if isinstance(file, FILE_PATH_TYPES):
+        return Path(file) if os.path.isfile(file) else None
+
+    # The name of a file object can be anything, e.g. the filename of an in-memory upload. Only trust it if the file
+    # is backed by a file descriptor that refers to the very file the name points at.
+    name, fileno = getattr(file, "name", None), getattr(file, "fileno", None)
+    if not isinstance(name, str) or fileno is None:
+        return None
+    try:
+        descriptor_stat, path_stat = os.fstat(fileno()), os.stat(name)
+    except (OSError, ValueError):  # No file descriptor (e.g. `BytesIO`), closed or the path doesn't exist
+        return None
+    if stat.S_ISREG(descriptor_stat.st_mode) and os.path.samestat(descriptor_stat, path_stat):
+        return Path(name)
+    return None
+
+
+def _output_format(arguments: tuple[str, ...]) -> Optional[str]:
+    """
+    Get the output format set with `-f` in the given ffmpeg arguments
+
+    Args:
+        arguments (tuple[str, ...]): The ffmpeg arguments following the input
+
+    Returns:
+        The output format or None if it is not set
+    """
+    if "-f" in arguments and (index := arguments.index("-f") + 1) < len(arguments):
+        return arguments[index]
+    return None
+
+
+async def ffmpeg(input: FFmpegInput, *arguments: str) -> BytesIO | None:
     """
     Run an ffmpeg command
 
+    The input is streamed into ffmpeg while its output is read at the same time, so neither side has to wait for the
+    other to finish. Given a `FileStream`, e.g. `Downloadable.download_stream()`, ffmpeg already starts working while
+    the file is still being downloaded. Given a `Path`, ffmpeg reads the file itself without it passing through Python.
+
+    Formats in `SEEKABLE_OUTPUT_FORMATS` (e.g. mp4) are written to a temporary file instead of a pipe, as their muxer
+    has to go back and update the file once it's done.
+
+    At most `FFMPEG_PARALLELISM` (see `set_ffmpeg_parallelism`) commands run at the same time, further ones wait. Too
+    many parallel encodes only compete for CPU and memory and end up slower overall.
+
+    Cancelling the call kills the ffmpeg process and closes the input stream right away, freeing the slot for the next
+    command.
+
     Args:
-        input (bytes): Input file data
+        input (FFmpegInput): Input file data or path
         *arguments (list[str]): Parameters for ffmpeg command
 
     Returns:
         The new file as BytesIO or None if it failed
     """
-    input_file = "-i", "pipe:0"
+    async with _ffmpeg_semaphore():
+        input_file = "-i", str(input) if isinstance(input, Path) else "pipe:0"
 
-    process = await subprocess.create_subprocess_exec(
-        "ffmpeg",
-        "-y",
-        *input_file,
-        *arguments,
-        "pipe:1",
-        stdin=subprocess.PIPE,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.DEVNULL,
-    )
+        output_path = None
+        if _output_format(arguments) in SEEKABLE_OUTPUT_FORMATS:
+            descriptor, output_path = mkstemp(prefix="tgtools-")
+            os.close(descriptor)
+
+        try:
+            process = await subprocess.create_subprocess_exec(
+                FFMPEG_BINARY,
+                "-y",
+                *input_file,
+                *arguments,
+                output_path or "pipe:1",
+                stdin=subprocess.DEVNULL if isinstance(input, Path) else subprocess.PIPE,
+                stdout=subprocess.DEVNULL if output_path else subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+            )
+
+            output = BytesIO()
+            await _supervise(
+                process,
+                *([] if isinstance(input, Path) else [_feed(process.stdin, input)]),  # type: ignore[arg-type]
+                *([] if output_path else [_drain(process.stdout, output)]),  # type: ignore[arg-type]
+            )
 
-    stdout, _ = await process.communicate(input)
-    return BytesIO(stdout) if stdout else None
+            if output_path:
+                if process.returncode != 0:
+                    return None
+                output = BytesIO(await AsyncPath(output_path).read_bytes())
+                output.seek(0, SEEK_END)
+        finally:
+            if output_path:
+                os.unlink(output_path)
 
+        if not output.tell():
+            return None
+        output.seek(0)
+        return output
 
-async def ffprobe(input: bytes, *arguments: str) -> dict[str, Any]:
+
+async def ffprobe(input: Union[FileBuffer, Path], *arguments: str) -> dict[str, Any]:
     """
     Run an ffprobe command
 
+    Like with `ffmpeg` the input is fed in chunks while the output is read, ffprobe usually only needs the start of
+    the file anyway.
+
     Args:
-        input (bytes): Input file data
+        input (Union[FileBuffer, Path]): Input file data or path
         *arguments (list[str]): Parameters for ffmpeg command
 
     Returns:
@@ -58,33 +409,64 @@ async def ffprobe(input: bytes, *arguments: str) -> dict[str, Any]:
     output_format = "-of", "json"
 
     process = await subprocess.create_subprocess_exec(
-        "ffprobe",
+        FFPROBE_BINARY,
         *arguments,
         *output_format,
-        "-",
-        stdin=subprocess.PIPE,
+        str(input) if isinstance(input, Path) else "-",
+        stdin=subprocess.DEVNULL if isinstance(input, Path) else subprocess.PIPE,
         stdout=subprocess.PIPE,
         stderr=subprocess.DEVNULL,
     )
 
-    try:
-        stdout, _ = await process.communicate(input)
-    except BrokenPipeError:
-        pass
+    output = BytesIO()
+    await _supervise(
+        process,
+        *([] if isinstance(input, Path) else [_feed(process.stdin, input)]),  # type: ignore[arg-type]
+        _drain(process.stdout, output),  # type: ignore[arg-type]
+    )
+
+    stdout = output.getvalue()
+    return json_loads(stdout) if stdout else None  # type: ignore[no-any-return ]
 
-    return json.loads(stdout) if stdout else None  # type: ignore[no-any-return ]
 
+async def read_head(input: Union[FileBuffer, Path], size: int) -> FileBuffer:
+    """
+    Read the first bytes of a file held in memory or on disk
+
+    Args:
+        input (Union[FileBuffer, Path]): The file's content or path
+        size (int): The number of bytes to read at most
 
-async def read_file_like(file: FileOrPath) -> bytes:
+    Returns:
+        The start of the file, without copying if it is already in memory
+    """
+    if isinstance(input, Path):
+        async with AsyncPath(input).open("rb") as file:
+            return await file.read(size)  # type: ignore[no-any-return]
+    return memoryview(input).cast("B")[:size]
+
+
+async def read_file_like(file: FileOrPath) -> FileBuffer:
     """
     Read and return bytes from file like or file path
+
+    Content that is already held in memory as `bytes`, `bytearray` or `memoryview` is returned as is without copying.
+    The content of a `BytesIO` is not copied either, `getvalue` shares the buffer until the `BytesIO` is written to.
     """
+    if isinstance(file, (bytes, bytearray, memoryview)):
+        return file
+    if isinstance(file, BytesIO):
+        # `getvalue` ignores the position, it is reset only to leave the file like all others
+        file.seek(0)
+        return file.getvalue()
+    if isinstance(file, FILE_PATH_TYPES):
+        if os.stat(file).st_size <= SYNC_READ_SIZE:
+            with open(file, "rb") as opened:
+                return opened.read()
+        return await AsyncPath(file).read_bytes()  # type: ignore[no-any-return]
+
     await seek(file=file, offset=0)
-    if isinstance(file, FilePath):  # type: ignore[arg-type, misc]
-        content = await AsyncPath(file).read_bytes()
-    elif isinstance(file, BytesIO):
-        content = file.getvalue()
-    elif (read := getattr(file, "read", None)) and iscoroutinefunction(read):
+    if (read := getattr(file, "read", None)) and _is_coroutine_method(read, file, "read"):
         content = await read()
     else:
         content = file.read()  # type: ignore[union-attr]
@@ -0,0 +1,84 @@
+from typing import Optional
+
+from tgtools.utils.types import FileBuffer
+
+__all__ = ["peek_image_size"]
+
+_JPEG_SOF_MARKERS = frozenset(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+"""JPEG start of frame markers, the ones in between are used for Huffman and arithmetic coding tables"""
+
+
+def _jpeg_size(data: memoryview) -> Optional[tuple[int, int]]:
+    """
+    Find the size of a JPEG in its start of frame segment
+
+    Args:
+        data (memoryview): The JPEG file
+
+    Returns:
+        A tuple of width and height or None if no start of frame segment was found
+    """
+    position = 2
+    while position + 9 <= len(data):
+        if data[position] != 0xFF:
+            return None
+        marker = data[position + 1]
+        if marker == 0xFF:  # Fill byte
+            position += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD7:  # Markers without a segment
+            position += 2
+            continue
+        if marker in _JPEG_SOF_MARKERS:
+            height = int.from_bytes(data[position + 5 : position + 7], "big")
+            width = int.from_bytes(data[position + 7 : position + 9], "big")
+            return width, height
+        position += 2 + int.from_bytes(data[position + 2 : position + 4], "big")
+    return None
+
+
+def _webp_size(data: memoryview) -> Optional[tuple[int, int]]:
+    """
+    Find the size of a WebP in the header of its first chunk
+
+    Args:
+        data (memoryview): The WebP file
+
+    Returns:
+        A tuple of width and height or None if the chunk is not known
+    """
+    chunk = bytes(data[12:16])
+    if chunk == b"VP8 " and len(data) >= 30:  # Lossy
+        return (
+            int.from_bytes(data[26:28], "little") & 0x3FFF,
+            int.from_bytes(data[28:30], "little") & 0x3FFF,
+        )
+    if chunk == b"VP8L" and len(data) >= 25:  # Lossless
+        bits = int.from_bytes(data[21:25], "little")
+        return (bits & 0x3FFF) + 1, (bits >> 14 & 0x3FFF) + 1
+    if chunk == b"VP8X" and len(data) >= 30:  # Extended, e.g. with alpha or animated
+        return int.from_bytes(data[24:27], "little") + 1, int.from_bytes(data[27:30], "little") + 1
+    return None
+
+
+def peek_image_size(data: FileBuffer) -> Optional[tuple[int, int]]:
+    """
+    Read the size of a JPEG, PNG, GIF or WebP image from its header without decoding it
+
+    Args:
+        data (FileBuffer): The image file
+
+    Returns:
+        A tuple of width and height in that order or None if the format is not known or the header is invalid
+    """
+    view = memoryview(data).cast("B")
+    header = bytes(view[:12])
+    if header.startswith(b"\xff\xd8"):
+        return _jpeg_size(view)
+    if header.startswith(b"\x89PNG\r\n\x1a\n") and len(view) >= 24:
+        return int.from_bytes(view[16:20], "big"), int.from_bytes(view[20:24], "big")
+    if header.startswith((b"GIF87a", b"GIF89a")) and len(view) >= 10:
+        return int.from_bytes(view[6:8], "little"), int.from_bytes(view[8:10], "little")
+    if header.startswith(b"RIFF") and header[8:12] == b"WEBP":
+        return _webp_size(view)
+    return None
@@ -0,0 +1,159 @@
+from dataclasses import dataclass
+from typing import Optional
+
+from tgtools.utils.types import FileBuffer
+
+__all__ = ["MatroskaTrack", "peek_tracks", "PEEK_SIZE", "TRACK_TYPE_VIDEO", "TRACK_TYPE_AUDIO"]
+
+PEEK_SIZE = 64 * 1024
+"""Number of bytes at the start of a file the track information is looked for in"""
+
+TRACK_TYPE_VIDEO = 1
+TRACK_TYPE_AUDIO = 2
+
+_EBML_HEADER = 0x1A45DFA3
+_SEGMENT = 0x18538067
+_CLUSTER = 0x1F43B675
+_TRACKS = 0x1654AE6B
+_TRACK_ENTRY = 0xAE
+_TRACK_TYPE = 0x83
+_CODEC_ID = 0x86
+
+
+@dataclass(frozen=True)
+class MatroskaTrack:
+    """
+    A track of a Matroska (mkv) or WebM file
+
+    Attributes:
+        type (int): The type of the track, e.g. `TRACK_TYPE_VIDEO` or `TRACK_TYPE_AUDIO`
+        codec (str): The Matroska codec ID, e.g. `V_MPEG4/ISO/AVC` or `A_OPUS`
+    """
+
+    type: int
+    codec: str
+
+
+def _read_vint(data: memoryview, position: int, keep_marker: bool) -> tuple[Optional[int], int]:
+    """
+    Read an EBML variable length integer
+
+    Args:
+        data (memoryview): The data to read from
+        position (int): The position the integer starts at
+        keep_marker (bool): Keep the length marker bit, as is done for element IDs
+
+    Returns:
+        The value (None if it is reserved for "unknown") and the position after the integer
+
+    Raises:
+        ValueError: If the data ends before the integer or it is invalid
+    """
+    if position >= len(data) or not (first := data[position]):
+        raise ValueError("Invalid or truncated EBML integer")
+
+    length = 9 - first.bit_length()
+    if position + length > len(data):
+        raise ValueError("Truncated EBML integer")
+
+    value = first if keep_marker else first & (0xFF >> length)
+    for byte in data[position + 1 : position + length]:
+        value = value << 8 | byte
+
+    if not keep_marker and value == (1 << 7 * length) - 1:
+        return None, position + length
+    return value, position + length
+
+
+def _read_element(data: memoryview, position: int) -> tuple[int, Optional[int], int]:
+    """
+    Read the header of an EBML element
+
+    Args:
+        data (memoryview): The data to read from
+        position (int): The position the element starts at
+
+    Returns:
+        The element ID, the size of its content (None if unknown) and the position its content starts at
+    """
+    element_id, position = _read_vint(data, position, keep_marker=True)
+    size, position = _read_vint(data, position, keep_marker=False)
+    return element_id, size, position  # type: ignore[return-value]
+
+
+def _read_track(data: memoryview, position: int, end: int) -> Optional[MatroskaTrack]:
+    """
+    Read the type and codec of a single TrackEntry element
+
+    Args:
+        data (memoryview): The data to read from
+        position (int): The position the content of the TrackEntry starts at
+        end (int): The position the content of the TrackEntry ends at
+
+    Returns:
+        The track or None if it is missing its type or codec
+    """
+    track_type, codec = None, None
+    while position < end:
+        element_id, size, position = _read_element(data, position)
+        if size is None:
+            return None
+        if element_id == _TRACK_TYPE:
+            track_type = int.from_bytes(data[position : position + size], "big")
+        elif element_id == _CODEC_ID:
+            codec = bytes(data[position : position + size]).rstrip(b"\0").decode("ascii", "replace")
+        position += size
+
+    if track_type is None or codec is None:
+        return None
+    return MatroskaTrack(type=track_type, codec=codec)
+
+
+def peek_tracks(data: FileBuffer) -> Optional[list[MatroskaTrack]]:
+    """
+    Read the tracks of a Matroska or WebM file from its headers
+
+    Only the first `PEEK_SIZE` bytes are looked at. In virtually all files the track information comes right after the
+    file header, so this is much cheaper than probing the file with ffprobe.
+
+    Args:
+        data (FileBuffer): The file's content, only the start of it is needed
+
+    Returns:
+        The tracks of the file or None if the data is not a Matroska file or its tracks are not within the peeked bytes
+    """
+    view = memoryview(data).cast("B")[:PEEK_SIZE]
+    try:
+        element_id, size, position = _read_element(view, 0)
+        if element_id != _EBML_HEADER or size is None:
+            return None
+
+        element_id, _, position = _read_element(view, position + size)
+        if element_id != _SEGMENT:
+            return None
+
+        while position < len(view):
+            element_id, size, position = _read_element(view, position)
+            if element_id == _CLUSTER or size is None:
+                return None  # The tracks are always defined before the first cluster of frames
+            if element_id == _TRACKS:
+                break
+            position += size
+        else:
+            return None
+
+        end = position + size
+        if end > len(view):
+            return None
+
+        tracks = []
+        while position < end:
+            element_id, size, position = _read_element(view, position)
+            if size is None:
+                return None
+            if element_id == _TRACK_ENTRY and (track := _read_track(view, position, position + size)):
+                tracks.append(track)
+            position += size
+        return tracks
+    except ValueError:
+        return None
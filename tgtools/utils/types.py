@@ -1,17 +1,30 @@
 from pathlib import Path
-from typing import IO, Type, Union
+from typing import IO, TYPE_CHECKING, AsyncIterable, Type, Union
 
 from aiopath import AsyncPath
-from telegram import Animation, Document, PhotoSize, Video
+
+if TYPE_CHECKING:
+    from telegram import Animation, Document, PhotoSize, Video
 
 FileLike = IO[bytes]
 """Either a bytes-stream (e.g. open file handler) or a similar object that supports read and write (sync or async)."""
 
 FilePath = Union[str, Path, AsyncPath]
 """A filepath either as string, as pathlib.Path or aiopath.AsyncPath object."""
+FILE_PATH_TYPES = (str, Path, AsyncPath)
+"""The types of `FilePath` for `isinstance` checks, which are much faster with a tuple than with a `Union`"""
+
+FileBuffer = Union[bytes, bytearray, memoryview]
+"""The raw content of a file held in memory, e.g. a `memoryview` into a preallocated download buffer."""
+
+FileOrPath = Union[FileLike, FilePath, FileBuffer]
+"""Representing any kind of file as file like, path like or raw content"""
+
+FileStream = AsyncIterable[bytes]
+"""The content of a file arriving chunk by chunk, e.g. while it is still being downloaded."""
 
-FileOrPath = Union[FileLike, FilePath]
-"""Representing any kind of file as file like or path like"""
+FFmpegInput = Union[FileBuffer, FileStream, Path]
+"""The input of an ffmpeg command, either in memory, arriving chunk by chunk or as a file on disk."""
 
 IMAGE_TYPES = ["jpeg", "jpg", "png", "webp"]
 """Common image extensions"""
@@ -20,5 +33,5 @@ VIDEO_TYPES = ["mp4", "mkv", "webm"]
 GIF_TYPES = ["gif"]
 """GIF extension"""
 
-TELEGRAM_FILES = Union[Type[Video], Type[Animation], Type[PhotoSize], Type[Document]]
+TELEGRAM_FILES = Union[Type["Video"], Type["Animation"], Type["PhotoSize"], Type["Document"]]
 """A var representing all supported Telegram file types"""
@@ -1,4 +1,6 @@
-from typing import TypedDict
+from functools import lru_cache
+from typing import Optional, TypedDict
+from urllib.parse import urlsplit
 
 from emoji import emojize
 from yarl import URL
@@ -65,6 +67,61 @@ FALLBACK_EMOJIS = {
     "picture": ":framed_picture:",
 }
 
+URL_INFO: dict[str, tuple[str, str]] = {
+    url: (data["name"], emojize(data["emoji"])) for data in HOST_MAP.values() for url in data["urls"]
+}
+"""The name and the already converted emoji of the site of each host in `HOST_MAP`"""
+
+
+@lru_cache(maxsize=256)
+def _emojize(text: str) -> str:
+    """
+    Convert emoji shortcodes like the fallback emojis, caching the result as they are usually the same
+
+    Args:
+        text (str): The text containing shortcodes
+
+    Returns:
+        str: The text with the shortcodes replaced by emojis
+    """
+    return emojize(text)
+
+
+@lru_cache(maxsize=2048)
+def _parse_host(url: str) -> Optional[str]:
+    """
+    Parse the host of a URL, caching the result as the same URLs tend to be looked up repeatedly
+
+    Only the host is needed, so the URL is split with `urlsplit` instead of being fully parsed by `yarl`. Like with
+    `yarl` the host is lowercase and internationalized domain names are decoded.
+
+    Args:
+        url (str): The URL
+
+    Returns:
+        Optional[str]: The host of the URL, None if it has none
+    """
+    host = urlsplit(url).hostname
+    if host and "xn--" in host:
+        try:
+            return host.encode("ascii").decode("idna")
+        except UnicodeError:
+            pass
+    return host
+
+
+def _host(url: str | URL) -> Optional[str]:
+    """
+    Get the host of a URL given as string or already parsed
+
+    Args:
+        url (str | URL): The URL
+
+    Returns:
+        Optional[str]: The host of the URL, None if it has none
+    """
+    return url.host if isinstance(url, URL) else _parse_host(url)
+
 
 def host_emoji(url: str | URL, fallback: str = FALLBACK_EMOJIS["picture"]) -> str:
     """
@@ -85,9 +142,8 @@ def host_emoji(url: str | URL, fallback: str = FALLBACK_EMOJIS["picture"]) -> st
         >>> host_emoji("https://pixiv.net")
         '🅿️'
     """
-    url = URL(url)
-    site_key = URL_MAP.get(url.host)  # type: ignore[arg-type]
-    return emojize(HOST_MAP[site_key]["emoji"]) if site_key else emojize(fallback)
+    info = URL_INFO.get(_host(url))  # type: ignore[arg-type]
+    return info[1] if info else _emojize(fallback)
 
 
 def host_name(url: str | URL, with_emoji: bool = False, fallback: str = FALLBACK_EMOJIS["picture"]) -> str:
@@ -110,16 +166,13 @@ def host_name(url: str | URL, with_emoji: bool = False, fallback: str = FALLBACK
         >>> host_name("https://pixiv.net", with_emoji=True)
         '🅿️ Pixiv'
     """
-    url = URL(url)
-    site_key = URL_MAP.get(url.host)  # type: ignore[arg-type]
-
-    if site_key:
-        name = HOST_MAP[site_key]["name"]
-        emoji = emojize(HOST_MAP[site_key]["emoji"]) if with_emoji else fallback
+    host = _host(url)
+    if info := URL_INFO.get(host):  # type: ignore[arg-type]
+        name, emoji = info
     else:
-        name = str(url.host if url.host else url)
+        name = host if host else str(url if isinstance(url, URL) else URL(url))
         if name and name[:4] == "www.":
             name = name[4:]
-        emoji = emojize(fallback)
+        emoji = _emojize(fallback)
 
     return f"{emoji} {name}" if with_emoji else str(name)